@@ -7,6 +7,7 @@ install_requires = [
     'click>=7.0',
     'keyring>=19.0.2',
     'pyyaml>=5',
+    'msgpack>=1.0',
     'watchdog>=0.9.0',
     'secretstorage>=3.1.1; platform_system=="Linux"',
     'py-notifier>=0.1.0',
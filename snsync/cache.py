@@ -3,12 +3,126 @@ import logging
 import os
 import json
 import hashlib
+import functools
+import msgpack
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
 from datetime import datetime
+from snsync.exceptions import InvalidCacheFile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Algorithm used to fingerprint file contents
+HASH_ALGO = 'sha256'
+
+# Size of the chunks read when hashing local files
+HASH_CHUNK_SIZE = 1 << 20
+
+# Format version byte written at the start of cache meta files
+META_VERSION = b'\x01'
+META_FILE_EXT = '.msgpack'
+# Meta files written by older versions
+LEGACY_META_FILE_EXT = '.json'
+
+# Name of the file in the cache directory listing the files found by the last scan
+SCAN_INDEX_FILE = 'scan.idx'
+# Version of the scan index layout, older indexes are discarded
+SCAN_INDEX_VERSION = 2
+# Directories modified within this many nanoseconds before the scan index was written
+# may have changed again within the same timestamp tick, so are always rescanned.
+# Covers filesystems with coarse timestamps, such as FAT's 2 seconds
+SCAN_INDEX_RACY_NS = 2 * 10 ** 9
+
+
+def hash_contents(contents):
+    """ Hash a string using HASH_ALGO
+    :param contents: string or bytes to hash
+    :returns: The hex digest of the string
+    """
+    if isinstance(contents, str):
+        contents = contents.encode()
+    return hashlib.new(HASH_ALGO, contents).hexdigest()
+
+
+def json_loads(data):
+    """ Parse JSON bytes, using orjson when it is installed """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pack_meta(meta):
+    """ Serialise record meta for writing to a cache meta file """
+    return META_VERSION + msgpack.packb(meta, use_bin_type=True)
+
+
+def meta_digest(data):
+    """ Fingerprint packed meta, to tell whether it has changed without keeping a copy """
+    return hashlib.sha256(data).digest()
+
+
+def unpack_meta(data):
+    """ Parse the contents of a cache meta file """
+    if data[:1] != META_VERSION:
+        raise InvalidCacheFile("Unknown cache meta file version: {!r}".format(data[:1]))
+    return msgpack.unpackb(data[1:], raw=False)
+
+
+def atomic_write(path, data):
+    """ Write bytes to a file so that it is never left partially written
+    :param path: path of the file to write
+    :param data: bytes to write
+    """
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _dir_mtime(path):
+    """ Get the modification time of a directory, or None if it does not exist """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _scandir_files(root, dirs=None):
+    """ Recursively yields the paths of all files below a directory
+    :param root: path to the directory to walk
+    :param dirs: Optional dict to record the modification time of each directory walked in
+    """
+    if dirs is not None:
+        # Taken before listing, so changes made while walking mark the directory as stale
+        dirs[root] = _dir_mtime(root)
+
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _scandir_files(entry.path, dirs)
+        elif entry.is_symlink() and entry.is_dir():
+            # Symlinks to directories are not followed
+            continue
+        else:
+            yield entry.path
+
 
 class ModStatus(Enum):
     NOCHANGE = 0
@@ -22,14 +136,69 @@ class LocalFile(object):
 
     def __init__(self, path):
         self._path = Path(path)
+        # Resolved path, used to compare this file against other paths
+        self._resolved = os.path.realpath(str(path))
+        # Tuple of ((mtime_ns, size), digest) for the last hashed version of the file
+        self._hash_cache = None
+        # Tuple of ((mtime_ns, size), contents) for the last read version of the file
+        self._contents_cache = None
+        # Tuple of ((mtime_ns, size), lines) for the last split version of the file
+        self._lines_cache = None
 
     @property
     def contents(self):
-        return self._path.read_bytes().decode()
+        """ The contents of the file, only re-read when the file changes on disk """
+        key = self.stat_key
+
+        if self._contents_cache and self._contents_cache[0] == key:
+            return self._contents_cache[1]
+
+        # Decode while reading, without translating newlines so the contents match the hash
+        with self._path.open('r', encoding='utf-8', newline='') as f:
+            contents = f.read()
+
+        self._contents_cache = (key, contents)
+        return contents
+
+    @property
+    def lines(self):
+        """ The contents of the file split into lines, only re-read when the file changes on disk
+        """
+        key = self.stat_key
+
+        if self._lines_cache and self._lines_cache[0] == key:
+            return self._lines_cache[1]
+
+        lines = self.contents.splitlines(True)
+        self._lines_cache = (key, lines)
+        return lines
+
+    @property
+    def stat_key(self):
+        """ Tuple of (mtime_ns, size) identifying the current version of the file """
+        st = self._path.stat()
+        return (st.st_mtime_ns, st.st_size)
 
     @property
     def hash(self):
-        return hashlib.md5(self._path.read_bytes()).hexdigest()
+        """ The hash of the file, only re-computed when the file changes on disk """
+        key = self.stat_key
+
+        if self._hash_cache and self._hash_cache[0] == key:
+            return self._hash_cache[1]
+
+        with self._path.open('rb') as f:
+            if hasattr(hashlib, 'file_digest'):
+                digest = hashlib.file_digest(f, HASH_ALGO).hexdigest()
+            else:
+                # Python < 3.11, hash the file in chunks
+                h = hashlib.new(HASH_ALGO)
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    h.update(chunk)
+                digest = h.hexdigest()
+
+        self._hash_cache = (key, digest)
+        return digest
 
     @property
     def mtime(self):
@@ -39,15 +208,22 @@ class LocalFile(object):
     def relative_path(self):
         return self._path.relative_to(Path.cwd())
 
+    @property
+    def resolved_path(self):
+        return self._resolved
+
     def samefile(self, file_path):
-        return self._path.samefile(file_path)
+        return os.path.realpath(file_path) == self._resolved
 
     def stats(self):
         return self._path.stats()
 
     def save(self, contents):
-        logger.debug("Saving file: {}".format(self._path))
+        logger.debug("Saving file: %s", self._path)
         self._path.write_text(contents)
+        self._hash_cache = None
+        self._contents_cache = None
+        self._lines_cache = None
 
     def __str__(self):
         return str(self._path)
@@ -71,25 +247,25 @@ class SNRecord(object):
         self.meta = meta or {}
         # File has not been saved if we have not passed in Meta
         self._new = (meta is not None)
+        # Digest of the packed meta as last read from or written to disk
+        self._saved_digest = None
 
     @property
     def table(self):
         return self.config['table']
 
-    @property
+    @functools.cached_property
     def file(self):
         """ The file this record should be saved too """
-        folders = self.name.split(os.sep)
-        return os.path.join(self.cache.path, self.record_type, *folders[:-1], folders[-1] + '.json')
+        return self.cache.get_meta_file(self.record_type, self.name)
 
     def get_sys_id(self, instance):
         return self.meta[instance]['sys_id']
 
     def get_sn_keys(self):
         """ Get the fields and their values to look this record up in Service Now """
-        keys = self.config['key'].split('/')
         values = self.name.split(os.sep)
-        return dict(zip(keys, values))
+        return dict(zip(self.config['_key_fields'], values))
 
     def get_sn_field(self, instance, field):
         """ Get the meta for a field on a particular instance
@@ -105,16 +281,13 @@ class SNRecord(object):
         """ Adds a local file to the map
         :param file: path to the local file
         :param file_ext: extension of the local file
+        :returns: The LocalFile added
         """
 
         # Get the name of the field for this extension
-        field = None
-        for name, ext in self.config['fields'].items():
-            if ext == file_ext:
-                field = name
-                break
-
-        self.lfile_field_map[field] = LocalFile(file)
+        field = self.config['_ext_map'].get(file_ext)
+        lfile = self.lfile_field_map[field] = LocalFile(file)
+        return lfile
 
     def is_new(self):
         """ Returns True if this file has never been saved """
@@ -125,8 +298,9 @@ class SNRecord(object):
         :param file_path: path to a local file
         :returns: The field name
         """
+        resolved = os.path.realpath(file_path)
         for field, lfile in self.lfile_field_map.items():
-            if lfile.samefile(file_path):
+            if lfile.resolved_path == resolved:
                 return field
         return None
 
@@ -135,18 +309,12 @@ class SNRecord(object):
         :param files: List of files to filter by
         :returns: A list of tuples contain field, file values
         """
+        if not files:
+            return list(self.lfile_field_map.items())
 
-        files = []
-
-        for field, file in self.lfile_field_map.items():
-            if files is not None:
-                for file_path in files:
-                    if not self.contains_file(file_path):
-                        continue
-
-            files.append((field, file))
-
-        return files
+        wanted = {os.path.realpath(file_path) for file_path in files}
+        return [(field, file) for field, file in self.lfile_field_map.items()
+                if file.resolved_path in wanted]
 
     def contains_file(self, file_path):
         """ Checks to see if this record is responsible for a local file
@@ -164,48 +332,112 @@ class SNRecord(object):
         if not self.meta.get(instance):
             self.meta[instance] = {}
 
-        self.meta[instance]['sys_id'] = meta['sys_id']
-        self.meta[instance]['updated_on'] = meta['sys_updated_on']
-        self.meta[instance]['updated_by'] = meta['sys_updated_by']
+        imeta = self.meta[instance]
+        imeta['sys_id'] = meta['sys_id']
+        imeta['updated_on'] = meta['sys_updated_on']
+        imeta['updated_by'] = meta['sys_updated_by']
 
-        if 'fields' not in self.meta[instance]:
-            self.meta[instance]['fields'] = {}
+        fields = imeta.setdefault('fields', {})
 
         # Update the fields
         for name in self.config['fields'].keys():
-            if name not in self.meta[instance]['fields']:
-                self.meta[instance]['fields'][name] = {}
-
-            cfield = self.meta[instance]['fields'].get(name, {})
+            cfield = fields.setdefault(name, {})
+            self.migrate_field_hashes(cfield)
             chash = cfield.get('hash', None)
             phash = cfield.get('prev_hash', None)
-            rhash = hashlib.md5(meta[name].encode()).hexdigest()
+            contents = meta[name]
+
+            # Only hash the remote contents if they differ from what we have cached
+            if chash is not None and contents == cfield.get('contents'):
+                rhash = chash
+            else:
+                rhash = hash_contents(contents)
 
             # If we don't have a phash and the hash has changed save it
             if phash is None and chash != rhash:
-                self.meta[instance]['fields'][name]['prev_hash'] = chash
-                self.meta[instance]['fields'][name]['prev_contents'] = cfield.get('contents', None)
+                cfield['prev_hash'] = chash
+                cfield['prev_contents'] = cfield.get('contents', None)
 
-            self.meta[instance]['fields'][name]['hash'] = rhash
-            self.meta[instance]['fields'][name]['contents'] = meta[name]
+            cfield['hash'] = rhash
+            cfield['hash_algo'] = HASH_ALGO
+            cfield['contents'] = contents
+
+    @staticmethod
+    def migrate_field_hashes(field):
+        """ Re-hash the stored contents of a field if it was hashed with an older algorithm
+        :param field: the meta dict of a field
+        """
+        if not field or field.get('hash_algo') == HASH_ALGO:
+            return
+
+        logger.debug("Re-hashing cached field with %s", HASH_ALGO)
+
+        for hash_key, contents_key in (('hash', 'contents'), ('prev_hash', 'prev_contents')):
+            if field.get(contents_key) is not None:
+                field[hash_key] = hash_contents(field[contents_key])
+            else:
+                field[hash_key] = None
+
+        field['hash_algo'] = HASH_ALGO
+        # The stored local hash is from the old algorithm as well
+        field.pop('local_stat', None)
+        field.pop('local_hash', None)
+
+    def get_local_hash(self, instance, name, lfile):
+        """ Get the hash of a local file, reusing the hash stored in the meta if the
+            file has not changed since it was last hashed
+        :param instance: Name of the Service Now instance
+        :param name: Name of the field the file belongs to
+        :param lfile: The LocalFile
+        :returns: The hash of the local file
+        """
+        field = self.get_sn_field(instance, name)
+        if field is None or field.get('hash_algo') != HASH_ALGO:
+            return lfile.hash
+
+        stat_key = list(lfile.stat_key)
+        if field.get('local_stat') == stat_key and field.get('local_hash'):
+            return field['local_hash']
+
+        local_hash = lfile.hash
+        field['local_stat'] = stat_key
+        field['local_hash'] = local_hash
+        return local_hash
 
     def update_field_meta(self, instance, name):
         """ Updates the previous hash for a field """
-        logger.debug("Updating previous values on instance {} field {}".format(instance, name))
+        logger.debug("Updating previous values on instance %s field %s", instance, name)
         field = self.meta[instance]['fields'][name]
         self.meta[instance]['fields'][name]['prev_hash'] = field['hash']
         self.meta[instance]['fields'][name]['prev_contents'] = field['contents']
 
+    def mark_dirty(self):
+        """ Mark this record to be saved the next time the cache is flushed """
+        self.cache.mark_dirty(self)
+
     def save(self):
         """ Saves the file to the local cache directory """
-        meta_file = Path(self.file)
+        meta_file = self.file
+        data = pack_meta(self.meta)
+
+        # Nothing to write if the meta is unchanged since it was read or last saved
+        digest = meta_digest(data)
+        if digest == self._saved_digest:
+            logger.debug("Cache meta file %s unchanged - not saving", meta_file)
+            return
+
         # Create any parents that need to exist
-        meta_file.parent.mkdir(parents=True, exist_ok=True)
+        self.cache.ensure_dir(os.path.dirname(meta_file))
+
+        logger.debug("Saving cache meta file %s", meta_file)
 
-        logger.debug("Saving cache meta file {}".format(meta_file))
+        atomic_write(meta_file, data)
+        self._saved_digest = digest
 
-        with open(meta_file, 'w') as outfile:
-            json.dump(self.meta, outfile)
+        # Remove the meta file written by older versions, now that it has been migrated
+        legacy_file = self.cache.get_meta_file(self.record_type, self.name, LEGACY_META_FILE_EXT)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
 
         self._saved = True
 
@@ -227,21 +459,19 @@ class SNRecord(object):
             check_fields = self.lfile_field_map
 
         comparison = []
+        fields = self.meta[instance]['fields']
 
         for name, lfile in check_fields.items():
-            field = self.meta[instance]['fields'][name]
+            field = fields[name]
+            self.migrate_field_hashes(field)
 
             # Get the different hashes
-            local_hash = lfile.hash
+            local_hash = self.get_local_hash(instance, name, lfile)
             remote_hash = field['hash']
-            try:
-                prev_remote_hash = field['prev_hash']
-            except KeyError:
-                prev_remote_hash = None
+            prev_remote_hash = field.get('prev_hash')
 
-            logger.debug("Local:\t" + local_hash)
-            logger.debug("Remote:\t" + remote_hash)
-            logger.debug("Prev:\t" + str(prev_remote_hash))
+            logger.debug("Hashes local=%s remote=%s prev=%s",
+                         local_hash, remote_hash, prev_remote_hash)
 
             # There can be 4 different cases when comparing a file:
             # 1. There are no changes local hash
@@ -256,18 +486,17 @@ class SNRecord(object):
 
             # Case 2: Remote Changes
             # Local and Remote conflict, but the local lines up with our previous hash
-            elif local_hash != remote_hash and \
-                    (prev_remote_hash is None or local_hash == prev_remote_hash):
+            elif prev_remote_hash is None or local_hash == prev_remote_hash:
                 comparison.append((name, field, lfile, ModStatus.REMOTE))
 
             # Case 3: Local Changes
             # Local and Remote Conflict, but prev hash and remote hash match
-            elif local_hash != remote_hash and remote_hash == prev_remote_hash:
+            elif remote_hash == prev_remote_hash:
                 comparison.append((name, field, lfile, ModStatus.LOCAL))
 
             # Case 4: Local and Remote Changes
             # No hashes match
-            elif local_hash != remote_hash != prev_remote_hash:
+            else:
                 comparison.append((name, field, lfile, ModStatus.BOTH))
 
         return comparison
@@ -280,6 +509,12 @@ class SNCache(object):
         self.config = config
         # Records grouped by type
         self.records = {}
+        # Map of resolved local file paths to the record they belong to
+        self._path_index = {}
+        # Directories within the cache that are known to exist
+        self._ensured_dirs = set()
+        # Records waiting to be saved by flush, keyed by type and key
+        self._dirty = {}
 
     @property
     def root(self):
@@ -293,52 +528,158 @@ class SNCache(object):
     def record_types(self):
         return self.config.records.keys()
 
-    def scan(self, record_types=None):
+    @property
+    def scan_index_file(self):
+        return os.path.join(self.path, SCAN_INDEX_FILE)
+
+    def scan(self, record_types=None, use_index=True):
         """ Performs a scan optionally limited to a set of record types
+        The files found for each record type are saved to a scan index, along with the
+        modification time of every directory walked. While none of those directories have
+        changed, the files are taken from the index instead of walking the directories again.
+        Paths in the index are relative to the repository root, so a copied repository
+        never picks up the files of the original. As in git's racy index handling, a
+        directory modified shortly before the index was written is never trusted.
         :param record_types: List of record types to scan
+        :param use_index: Use the saved scan index if it is still fresh
         """
 
         if record_types is None:
             record_types = self.record_types
 
+        index, index_mtime = self.load_scan_index() if use_index else ({}, None)
+        index_changed = not use_index
+
+        root = self.root
+
+        def is_fresh(entry):
+            for d, mtime in entry['dirs'].items():
+                if mtime is not None and mtime >= index_mtime - SCAN_INDEX_RACY_NS:
+                    return False
+                if _dir_mtime(os.path.join(root, d)) != mtime:
+                    return False
+            return True
+
         for rtype in record_types:
-            path = Path(os.path.join(self.root, rtype))
+            path = os.path.join(root, rtype)
             rconfig = self.config.get_record_config(rtype)
 
             if rtype not in self.records:
                 self.records[rtype] = {}
 
-            for file in path.rglob('*'):
-                if file.is_dir():
-                    continue
-                self.scan_file(path, rconfig, rtype, file)
+            entry = index.get(rtype)
+            if entry is None or not is_fresh(entry):
+                logger.debug("Scanning %s", path)
+                dirs = {}
+                files = list(_scandir_files(path, dirs))
+                entry = index[rtype] = {
+                    'dirs': {os.path.relpath(d, root): mtime for d, mtime in dirs.items()},
+                    'files': [os.path.relpath(file, root) for file in files]
+                }
+                index_changed = True
+
+            for file in entry['files']:
+                self.scan_file(path, rconfig, rtype, os.path.join(root, file))
+
+        if index_changed:
+            self.save_scan_index(index)
+
+    def load_scan_index(self):
+        """ Load the saved scan index
+        :returns: A tuple of a dict of the directories and files of each record type,
+            and the modification time of the index file
+        """
+        try:
+            with open(self.scan_index_file, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                index = unpack_meta(f.read())
+        except FileNotFoundError:
+            return {}, None
+        except (InvalidCacheFile, ValueError) as exc:
+            logger.debug("Ignoring unreadable scan index: %s", exc)
+            return {}, None
+
+        if not isinstance(index, dict) or index.get('version') != SCAN_INDEX_VERSION:
+            logger.debug("Ignoring scan index from an older version")
+            return {}, None
+        return index['records'], mtime
+
+    def save_scan_index(self, index):
+        """ Save the scan index
+        :param index: A dict of the directories and files of each record type
+        """
+        self.ensure_dir(self.path)
+        logger.debug("Saving scan index %s", self.scan_index_file)
+        data = pack_meta({'version': SCAN_INDEX_VERSION, 'records': index})
+        atomic_write(self.scan_index_file, data)
 
     def scan_file(self, path, rconfig, record_type, file):
         """ Scan a single file
-        :param config: configuration for the record type
-        :param file_path: Path to the file
+        :param path: path to the directory of the record type
+        :param rconfig: configuration for the record type
+        :param record_type: the type of record
+        :param file: path to the file
         """
 
         # Workout the key and field this file relates to
-        rel = file.relative_to(path)
-        key, ext = os.path.splitext(str(rel))
+        key, ext = os.path.splitext(os.path.relpath(file, path))
 
         # Ensure that the file path corresponds to the key in the config
-        if len(key.split(os.sep)) != len(rconfig['key'].split('/')):
-            logger.warn('File location does not match key file: {} key: {}'.format(
-                    key, rconfig['key']))
+        if key.count(os.sep) + 1 != len(rconfig['_key_fields']):
+            logger.warning('File location does not match key file: %s key: %s',
+                           key, rconfig['key'])
             return
 
         # Check that the extension is correct
-        if ext in rconfig['fields'].values():
-            logger.debug("Found {}".format(file))
+        if ext in rconfig['_ext_map']:
+            logger.debug("Found %s", file)
             record = self.load_record(record_type, key)
-            record.add_lfile(str(file), ext)
+            lfile = record.add_lfile(file, ext)
+            self._path_index[lfile.resolved_path] = record
         else:
-            logger.warn("Unknown suffix for file: {} extension: {} expected: {}".format(
-                    file, ext, ','.join(rconfig['fields'].values())))
+            logger.warning("Unknown suffix for file: %s extension: %s expected: %s",
+                           file, ext, rconfig['_ext_expected'])
             return
 
+    def ensure_dir(self, path):
+        """ Create a directory and its parents, unless we have already done so
+        :param path: path to the directory
+        """
+        if path in self._ensured_dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        self._ensured_dirs.add(path)
+
+    def get_meta_file(self, record_type, key, ext=META_FILE_EXT):
+        """ Get the path to the cache meta file of a record
+        :param record_type: Type of the record
+        :param key: Key of the record
+        :param ext: Extension of the meta file
+        :returns: path to the meta file
+        """
+        return os.path.join(self.path, record_type, key + ext)
+
+    def prefetch_hashes(self, instance, records=None):
+        """ Hash the local files of records in parallel, so that later comparisons are cached
+            Files that have not changed since they were last hashed are not re-hashed
+        :param instance: Name of the Service Now instance the records will be compared with
+        :param records: List of SNRecords to hash the files of, defaults to all records
+        """
+        if records is None:
+            records = self.get_records()
+
+        jobs = [(record, name, lfile) for record in records
+                for name, lfile in record.lfile_field_map.items()]
+        if not jobs:
+            return
+
+        logger.debug("Hashing %s local files", len(jobs))
+
+        # hashlib releases the GIL while hashing, so threads hash files concurrently
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for _ in executor.map(lambda job: job[0].get_local_hash(instance, *job[1:]), jobs):
+                pass
+
     def load_record(self, record_type, key):
         """ Load a record for the in-memory list or from the file system
         :param record_type: Type of record to load
@@ -350,32 +691,64 @@ class SNCache(object):
         if record_type in self.records and key in self.records[record_type]:
             return self.records[record_type][key]
 
-        # Try and load meta from disk from the disk
-        try:
-            folders = key.split(os.sep)
-            meta_file = os.path.join(self.path, record_type, *folders[:-1], folders[-1] + '.json')
-            logger.debug("Looking for file {}".format(meta_file))
-            with open(meta_file, 'r') as f:
-                meta = json.load(f)
-                logger.debug("Existing SNRecord loaded from disk")
-        except FileNotFoundError:
+        # Try and load meta from disk from the disk, falling back to the legacy JSON format
+        meta = None
+        for ext, loads in ((META_FILE_EXT, unpack_meta), (LEGACY_META_FILE_EXT, json_loads)):
+            meta_file = self.get_meta_file(record_type, key, ext)
+            logger.debug("Looking for file %s", meta_file)
+            try:
+                with open(meta_file, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+
+            try:
+                meta = loads(data)
+            except ValueError as exc:
+                raise InvalidCacheFile(
+                    "Unable to read cache meta file {}. Error: {}".format(meta_file, exc)) from exc
+            logger.debug("Existing SNRecord loaded from disk")
+            break
+        else:
             logger.debug("Existing SNRecord not found")
-            meta = None
 
         record = SNRecord(self, record_type, key, meta)
+        # Records still in the legacy format are always rewritten on save
+        if meta is not None and ext == META_FILE_EXT:
+            record._saved_digest = meta_digest(data)
         self.records[record_type][key] = record
         return record
 
+    def mark_dirty(self, record):
+        """ Mark a record to be saved the next time the cache is flushed
+        :param record: SNRecord to save
+        """
+        self._dirty[(record.record_type, record.name)] = record
+
+    def flush(self):
+        """ Save all records marked as dirty """
+        logger.debug("Flushing %d records", len(self._dirty))
+        while self._dirty:
+            _, record = self._dirty.popitem()
+            record.save()
+
     def get_records(self, files=None):
         """ Gets all records within this cache
 
         :param files: Optionally specify a list of local files to filter records by
         :returns: A list of SNRecord objects within this cache
         """
+        if files:
+            # Look the files up in the path index, keeping the order they were passed in
+            records = {}
+            for file in files:
+                record = self._path_index.get(os.path.realpath(file))
+                if record is not None:
+                    records[id(record)] = record
+            return list(records.values())
+
         records = []
         # Loop through each record type
         for rtype, values in self.records.items():
-            for key, record in values.items():
-                if not files or any(record.contains_file(file) for file in files):
-                    records.append(record)
+            records.extend(values.values())
         return records
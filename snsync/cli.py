@@ -1,11 +1,15 @@
 import click
+import functools
 import logging
 import sys
 from snsync import __version__
-from snsync.exceptions import ConfigurationFileNotFound, InvalidConfiguration, InstanceNotFound
+from snsync.exceptions import (
+    ConfigurationFileNotFound, InvalidConfiguration, InstanceNotFound, InvalidCacheFile,
+    RecordNotFound
+)
 from snsync.logging import configure_logger
 from snsync.config import SNConfig
-from snsync.cache import SNCache
+from snsync.snow import DEFAULT_WORKERS, POOL_MAXSIZE
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +18,7 @@ class SNContext(object):
     def __init__(self):
         self.config = None
         self.cache = None
+        self.workers = DEFAULT_WORKERS
 
 
 pass_sn_context = click.make_pass_decorator(SNContext, ensure=True)
@@ -33,7 +38,7 @@ def instance_option(*param_decls, **attrs):
                 return snctx.config.default_instance
 
             # Ensure that the instance name passed is in the configuration
-            if value not in snctx.config.instances:
+            if value not in snctx.config.instance_names:
                 raise InstanceNotFound("Unable to find instance {} in configuration".format(value))
             return value
 
@@ -45,6 +50,20 @@ def instance_option(*param_decls, **attrs):
     return decorator
 
 
+def report_errors(f):
+    """ Report errors raised while syncing with Service Now and exit, instead of a traceback """
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except RecordNotFound as e:
+            logger.critical(e)
+            sys.exit(1)
+
+    return wrapper
+
+
 @click.group()
 @click.version_option(__version__)
 @click.option(
@@ -53,11 +72,22 @@ def instance_option(*param_decls, **attrs):
     is_eager=True,
     default='INFO'
 )
+@click.option(
+    '--no-cache', is_flag=True,
+    help='Rescan all record directories instead of using the saved scan index'
+)
+@click.option(
+    '--workers', '-w', type=click.IntRange(min=1, max=POOL_MAXSIZE), default=DEFAULT_WORKERS,
+    show_default=True,
+    help='Maximum number of concurrent requests to Service Now'
+)
 @pass_sn_context
-def main(ctx, verbosity):
+def main(ctx, verbosity, no_cache, workers):
     # Configure logging
     configure_logger(verbosity)
 
+    ctx.workers = workers
+
     # Load Configuration
     try:
         ctx.config = SNConfig()
@@ -66,17 +96,27 @@ def main(ctx, verbosity):
         sys.exit(1)
 
     # Setup the cache
+    from snsync.cache import SNCache
     ctx.cache = SNCache(ctx.config)
-    ctx.cache.scan()
+    try:
+        ctx.cache.scan(use_index=not no_cache)
+    except InvalidCacheFile as e:
+        logger.critical(e)
+        sys.exit(1)
 
 
 @main.command('pull', short_help='Updates local files to match what is in Service Now')
 @click.argument('files', type=click.Path(exists=False), required=False, nargs=-1)
 @instance_option()
+@click.option(
+    '--force', '-f', is_flag=True,
+    help='Take the remote copy of files changed on both sides without prompting'
+)
 @pass_sn_context
-def pull(ctx, files, instance):
+@report_errors
+def pull(ctx, files, instance, force):
     from snsync.sync import do_pull
-    retval = do_pull(ctx.config, ctx.cache, instance, files)
+    retval = do_pull(ctx.config, ctx.cache, instance, files, confirm=not force, workers=ctx.workers)
 
     if retval:
         sys.exit(retval)
@@ -86,9 +126,10 @@ def pull(ctx, files, instance):
 @click.argument('instance', required=False)
 @instance_option()
 @pass_sn_context
+@report_errors
 def status(ctx, instance):
     from snsync.sync import get_status
-    retval = get_status(ctx.config, ctx.cache, instance)
+    retval = get_status(ctx.config, ctx.cache, instance, workers=ctx.workers)
 
     if retval:
         sys.exit(retval)
@@ -97,10 +138,15 @@ def status(ctx, instance):
 @main.command('push', short_help='Push local changes to Service Now')
 @click.argument('files', type=click.Path(exists=True), required=False, nargs=-1)
 @instance_option()
+@click.option(
+    '--force', '-f', is_flag=True,
+    help='Take the local copy of files changed on both sides without prompting'
+)
 @pass_sn_context
-def push(ctx, files, instance):
+@report_errors
+def push(ctx, files, instance, force):
     from snsync.sync import do_push
-    retval = do_push(ctx.config, ctx.cache, instance, files)
+    retval = do_push(ctx.config, ctx.cache, instance, files, confirm=not force, workers=ctx.workers)
 
     if retval:
         sys.exit(retval)
@@ -110,9 +156,10 @@ def push(ctx, files, instance):
 @click.argument('files', type=click.Path(exists=True), required=False, nargs=-1)
 @instance_option()
 @pass_sn_context
+@report_errors
 def diff(ctx, files, instance):
     from snsync.sync import do_diff
-    retval = do_diff(ctx.config, ctx.cache, instance, files)
+    retval = do_diff(ctx.config, ctx.cache, instance, files, workers=ctx.workers)
 
     if retval:
         sys.exit(retval)
@@ -121,9 +168,10 @@ def diff(ctx, files, instance):
 @main.command('watch', short_help='Watches for local changes and syncs them with Service Now')
 @instance_option()
 @pass_sn_context
+@report_errors
 def watch(ctx, instance):
     from snsync.sync import do_watch
-    retval = do_watch(ctx.config, ctx.cache, instance)
+    retval = do_watch(ctx.config, ctx.cache, instance, workers=ctx.workers)
 
     if retval:
         sys.exit(retval)
@@ -1,6 +1,6 @@
 import os
-import yaml
 import logging
+from functools import lru_cache
 from snsync.exceptions import ConfigurationFileNotFound, InvalidConfiguration
 
 logger = logging.getLogger(__name__)
@@ -10,15 +10,15 @@ INSTANCE_DEFAULT_CONFIG = {
     'verify_ssl': True
 }
 
-INSTANCE_REQUIRED_FIELDS = [
+INSTANCE_REQUIRED_FIELDS = frozenset((
     'host',
-]
+))
 
-RECORD_REQUIRED_FIELDS = [
+RECORD_REQUIRED_FIELDS = frozenset((
     'table',
     'key',
     'fields'
-]
+))
 
 
 def find_config_file(file_name):
@@ -26,14 +26,18 @@ def find_config_file(file_name):
         This searches for configuration files in the current directory and every directory above it
         If no configuration file is found raises an error
     """
+    return _find_config_file(os.getcwd(), file_name)
 
-    cur_dir = os.getcwd()
+
+@lru_cache(maxsize=16)
+def _find_config_file(cur_dir, file_name):
+    """ Searches for a configuration file from cur_dir upwards, cached per process """
 
     while True:
-        file_list = os.listdir(cur_dir)
+        candidate = os.path.join(cur_dir, file_name)
         parent_dir = os.path.dirname(cur_dir)
-        if file_name in file_list:
-            return os.path.join(cur_dir, file_name)
+        if os.path.exists(candidate):
+            return candidate
         # If we are at the root directory
         elif cur_dir == parent_dir:
             raise ConfigurationFileNotFound(
@@ -43,27 +47,24 @@ def find_config_file(file_name):
             cur_dir = parent_dir
 
 
-def merge_defaults(config, defaults):
-    """ Merge a configuration dict with a dict of defaults """
-
-    for key, value in defaults.items():
-        if key in config:
-            continue
-        config[key] = value
-
-
 class SNConfig(object):
 
     def __init__(self, config_file_name='snconfig.yaml'):
+        # Imported here to keep CLI startup fast
+        import yaml
+        try:
+            from yaml import CSafeLoader as SafeLoader
+        except ImportError:
+            from yaml import SafeLoader
 
         config_file = find_config_file(config_file_name)
 
-        logger.debug('Loading configuration file: {}'.format(config_file))
+        logger.debug('Loading configuration file: %s', config_file)
 
         # Load the configuration
         with open(config_file, 'r') as stream:
             try:
-                self._config = yaml.safe_load(stream)
+                self._config = yaml.load(stream, Loader=SafeLoader)
             except yaml.YAMLError as exc:
                 raise InvalidConfiguration(
                     'Unable to parse YAML file {}. Error: {}'
@@ -73,38 +74,52 @@ class SNConfig(object):
         self._config['config_file'] = config_file
         self._config['root_dir'] = os.path.dirname(config_file)
 
-        logger.debug('Repository root set to {}'.format(self._config['root_dir']))
+        logger.debug('Repository root set to %s', self._config['root_dir'])
 
         # Check and set defaults for instances
         for name, instance in self._config['instances'].items():
-            if not all(key in instance.keys() for key in INSTANCE_REQUIRED_FIELDS):
+            if not INSTANCE_REQUIRED_FIELDS.issubset(instance):
                 raise InvalidConfiguration(
                     'Instance {} missing required fields: {}'.format(
-                        name, ','.join(INSTANCE_REQUIRED_FIELDS)))
+                        name, ','.join(sorted(INSTANCE_REQUIRED_FIELDS - instance.keys()))))
 
             # Check for default
             if instance.get('default', False):
                 if 'default_instance' in self._config:
-                    logger.warn('Default instance already set to {}. Overwriting to {}'.format(
-                        self._config['default_instance'], name))
+                    logger.warning('Default instance already set to %s. Overwriting to %s',
+                                   self._config['default_instance'], name)
                 self._config['default_instance'] = name
 
             # Merge in defaults
-            merge_defaults(instance, INSTANCE_DEFAULT_CONFIG)
+            for key, value in INSTANCE_DEFAULT_CONFIG.items():
+                instance.setdefault(key, value)
 
         # Get the default instance, if not already set
         if 'default_instance' not in self._config:
             inst = list(self._config['instances'].keys())[0]
             self._config['default_instance'] = inst
 
-        logger.debug("Default service now instance: {}".format(self._config['default_instance']))
+        logger.debug("Default service now instance: %s", self._config['default_instance'])
 
         # Load and check the record options
         for name, record in self._config['records'].items():
-            if not all(key in record.keys() for key in RECORD_REQUIRED_FIELDS):
+            if not RECORD_REQUIRED_FIELDS.issubset(record):
                 raise InvalidConfiguration(
                     'Record {} missing required fields: {}'.format(
-                        name, ','.join(RECORD_REQUIRED_FIELDS)))
+                        name, ','.join(sorted(RECORD_REQUIRED_FIELDS - record.keys()))))
+
+            # Derived values used when scanning files
+            record['_ext_map'] = {ext: field for field, ext in record['fields'].items()}
+            record['_ext_expected'] = ','.join(record['fields'].values())
+            record['_key_fields'] = record['key'].split('/')
+
+        # Promote the commonly used keys to attributes, other keys are looked up by __getattr__
+        self.config_file = self._config['config_file']
+        self.root_dir = self._config['root_dir']
+        self.instances = self._config['instances']
+        self.instance_names = frozenset(self.instances)
+        self.default_instance = self._config['default_instance']
+        self.records = self._config['records']
 
     def __getattr__(self, name):
         return self._config[name]
@@ -30,3 +30,13 @@ class LoginFailed(SNSyncException):
 class UnknownAuthMethod(SNSyncException):
     """ Raised when an authentication method is not known """
     pass
+
+
+class InvalidCacheFile(SNSyncException):
+    """ Raised when a cache meta file cannot be read """
+    pass
+
+
+class RecordNotFound(SNSyncException):
+    """ Raised when a record cannot be found in an instance """
+    pass
@@ -4,10 +4,21 @@ import click
 
 class ClickHandler(logging.Handler):
 
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.stream = click.get_text_stream('stderr')
+        # Only keep colours when writing to a terminal
+        self._strip_colours = not self.stream.isatty()
+
     def emit(self, record):
         try:
             msg = self.format(record)
-            click.echo(msg)
+            if self._strip_colours:
+                msg = click.unstyle(msg)
+            self.stream.write(msg + '\n')
+            # Leave flushing lower levels to the stream's buffering
+            if record.levelno >= logging.WARNING:
+                self.stream.flush()
         except Exception:
             self.handleError(record)
 
@@ -36,10 +47,12 @@ class ColourFormatter(logging.Formatter):
 def configure_logger(log_level):
 
     logger = logging.getLogger('snsync')
-    logger.setLevel(logging.DEBUG)
 
     log_level = log_level.upper()
 
+    # Filter at the logger so disabled log calls return before creating a record
+    logger.setLevel(log_level)
+
     # Remove all attached handlers, in case there was
     # a logger with using the name 'snsync'
     del logger.handlers[:]
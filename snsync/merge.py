@@ -1,47 +1,61 @@
 """ Implements a 3 way merge """
 
+import functools
 import merge3
+from itertools import chain
+
+
+@functools.lru_cache(maxsize=32)
+def _merge_regions(base, mine, your, reprocess):
+    """ Compute the merge regions of a 3 way merge, cached for repeated merges of the same lines """
+    merge = merge3.Merge3(base, mine, your)
+    merge_regions = merge.merge_regions()
+    if reprocess is True:
+        merge_regions = merge.reprocess_merge_regions(merge_regions)
+    return tuple(merge_regions)
 
 
 def merge3_has_conflict(mine, base, your, reprocess=False):
     """ Reimplementing Merge3.merge_lines to return a has conflict """
 
     had_conflict = False
-    results = []
+    parts = []
 
-    merge = merge3.Merge3(base, mine, your)
+    # Tuples so the lines can be used as a cache key
+    mine, base, your = tuple(mine), tuple(base), tuple(your)
 
     # Workout the new line standard to use
     newline = '\n'
-    if len(base) > 0:
-        if base[0].endswith('\r\n'):
+    if base:
+        first_line = base[0]
+        if first_line.endswith('\r\n'):
             newline = '\r\n'
-        elif base[0].endswith('\r'):
+        elif first_line.endswith('\r'):
             newline = '\r'
 
-    start_marker = '<<<<<<< local'
-    mid_marker = '======='
-    end_marker = '>>>>>>> remote'
+    # Conflict marker lines, built once per merge
+    start_line = ('<<<<<<< local' + newline,)
+    mid_line = ('=======' + newline,)
+    end_line = ('>>>>>>> remote' + newline,)
 
-    merge_regions = merge.merge_regions()
-    if reprocess is True:
-        merge_regions = merge.reprocess_merge_regions(merge_regions)
-    for t in merge_regions:
+    # Collect the slices of each region and join them into the result in one pass
+    for t in _merge_regions(base, mine, your, reprocess):
         what = t[0]
         if what == 'unchanged':
-            results.extend(base[t[1]:t[2]])
+            parts.append(base[t[1]:t[2]])
         elif what == 'a' or what == 'same':
-            results.extend(mine[t[1]:t[2]])
+            parts.append(mine[t[1]:t[2]])
         elif what == 'b':
-            results.extend(your[t[1]:t[2]])
+            parts.append(your[t[1]:t[2]])
         elif what == 'conflict':
-            results.append(start_marker + newline)
-            results.extend(mine[t[1]:t[2]])
-            results.append(mid_marker + newline)
-            results.extend(your[t[1]:t[2]])
-            results.append(end_marker + newline)
+            # Conflict regions are (what, base_start, base_end, a_start, a_end, b_start, b_end)
+            parts.append(start_line)
+            parts.append(mine[t[3]:t[4]])
+            parts.append(mid_line)
+            parts.append(your[t[5]:t[6]])
+            parts.append(end_line)
             had_conflict = True
         else:
             raise ValueError(what)
 
-    return had_conflict, results
+    return had_conflict, list(chain.from_iterable(parts))
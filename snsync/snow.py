@@ -1,29 +1,57 @@
-import requests
-import click
 import logging
-from requests.auth import HTTPBasicAuth
 from snsync.exceptions import UnknownAuthMethod
 
 logger = logging.getLogger(__name__)
 
+# Size of the HTTP connection pools
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 32
+
+# Default number of requests get_many makes at once
+DEFAULT_WORKERS = 8
+
+# HTTP statuses that requests are retried on
+RETRY_STATUSES = (502, 503, 504)
+
 
 class SNClient(object):
     """ Very simple Service now client """
 
     def __init__(self, host, username=None, password=None,
                  headers=None, verify=True, read_only=False):
+        # Imported here to keep CLI startup fast
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.auth import HTTPBasicAuth
+        from urllib3.util.retry import Retry
+        try:
+            from orjson import loads as json_loads
+        except ImportError:
+            from json import loads as json_loads
+
+        self._json_loads = json_loads
+
         self.host = host
 
         self._session = requests.Session()
         self._session.verify = verify
 
+        # Reuse connections across requests, retrying idempotent requests on gateway errors
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=RETRY_STATUSES,
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                              max_retries=retries)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
         # Setup for basic auth
         if username is not None and password is not None:
             self._session.auth = HTTPBasicAuth(username, password)
 
         self._session.headers = {
             "Content-Type": "application/json",
-            "Accept": "application/json"
+            "Accept": "application/json",
+            "Connection": "keep-alive"
         }
 
         # Add any additional headers
@@ -31,25 +59,28 @@ class SNClient(object):
             self._session.headers.update(headers)
 
     def format_query(self, query_dict):
-
-        query = []
-
-        for key, value in query_dict.items():
-            query.append('{}={}'.format(key, value))
-
-        query = '^'.join(query)
-
-        return query
+        """ Format a dict of field values as a Service Now encoded query
+        The query is URL encoded by requests, but ^ separates conditions so is escaped as ^^
+        """
+        return '^'.join('{}={}'.format(key, str(value).replace('^', '^^'))
+                        for key, value in query_dict.items())
 
     def get(self, table, query=None, display=True, limit=None):
-        """ Fetch a record from service now """
+        """ Fetch a record from service now
+        :param table: Name of the table within Service Now
+        :param query: dict of field values to match, or an already encoded query string
+        :param display: Return display values
+        :param limit: Maximum number of records to return
+        """
 
         params = {
             'displayvalue': display
         }
 
         if query:
-            params['sysparm_query'] = self.format_query(query)
+            if isinstance(query, dict):
+                query = self.format_query(query)
+            params['sysparm_query'] = query
 
         if limit:
             params['sysparm_limit'] = limit
@@ -57,11 +88,28 @@ class SNClient(object):
         resp = self._session.get("{host}/{table}.do?JSONv2".format(
             host=self.host, table=table), params=params)
 
-        logger.debug("Requested: {}".format(resp.url))
+        logger.debug("Requested: %s", resp.url)
 
         resp.raise_for_status()
 
-        return resp.json()
+        return self._json_loads(resp.content)
+
+    def get_many(self, requests_list, max_workers=DEFAULT_WORKERS):
+        """ Fetch several queries from service now concurrently
+        :param requests_list: List of dicts of keyword arguments to pass to get
+        :param max_workers: Maximum number of requests to make at once
+        :returns: A list of the responses, in the same order as requests_list
+        """
+        if not requests_list:
+            return []
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # More workers than pooled connections would discard connections instead of reusing them
+        max_workers = min(max_workers, POOL_MAXSIZE)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda kwargs: self.get(**kwargs), requests_list))
 
     def create(self, table, values):
         pass
@@ -71,6 +119,7 @@ class SNClient(object):
         :param table: Name of the table within Service Now
         :param sys_id: sys_id of the record
         :param values: dict containing the fields to update
+        :returns: dict of the updated record, or None if it was not returned
         """
 
         params = {
@@ -85,7 +134,8 @@ class SNClient(object):
             json=values
         )
 
-        logger.debug("Requested: {}".format(resp.url))
+        logger.debug("Requested: %s", resp.url)
 
         resp.raise_for_status()
-        return resp.json()
+        records = self._json_loads(resp.content).get('records')
+        return records[0] if records else None
@@ -1,44 +1,90 @@
 import click
 import logging
+import os
 import keyring
 import difflib
+import queue
+import threading
 import time
+from itertools import chain
 from pathlib import Path
+from urllib.parse import quote
 from requests.exceptions import HTTPError
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
 from pynotifier import Notification
-from snsync.exceptions import LoginFailed
+from snsync.exceptions import LoginFailed, RecordNotFound
 from snsync.cache import ModStatus
-from snsync.snow import SNClient
+from snsync.snow import SNClient, DEFAULT_WORKERS
 from snsync.merge import merge3_has_conflict
 
+try:
+    # Use the C implementation of SequenceMatcher for difflib.unified_diff when installed
+    from cdifflib import CSequenceMatcher
+    difflib.SequenceMatcher = CSequenceMatcher
+except ImportError:
+    pass
+
 logger = logging.getLogger(__name__)
 
+# Maximum number of records to fetch in a single request
+BULK_FETCH_SIZE = 50
 
-def prompt_for_auth_details(instance):
-    """ Prompt or fetch authentication details
+# Maximum URL encoded length of the query of a single request, keeping its URL
+# well within the limits of servers and proxies
+BULK_QUERY_MAX_LENGTH = 4096
+
+# Seconds a watched file must be left unmodified before it is synced
+WATCH_DEBOUNCE = 0.3
+
+# Credentials fetched from the keyring or prompted for, keyed by instance
+_credentials = {}
+
+
+def get_stored_auth_details(instance):
+    """ Fetch authentication details already known to this process or stored in the keyring
     :param instance: Name of the instance to get credentials for
+    :returns: A tuple of username, password, either of which may be None
     """
 
+    # Credentials already fetched by this process
+    if instance in _credentials:
+        return _credentials[instance]
+
     # Check keyring
-    logger.debug("Checking keyring for credential for instance: {}".format(instance))
+    logger.debug("Checking keyring for credential for instance: %s", instance)
+
+    service = 'sn-sync-{}'.format(instance)
+    username = keyring.get_password(service, 'username')
+    password = keyring.get_password(service, 'password')
+
+    if username is not None and password is not None:
+        _credentials[instance] = (username, password)
+
+    return username, password
+
+
+def prompt_for_auth_details(instance):
+    """ Prompt or fetch authentication details
+    :param instance: Name of the instance to get credentials for
+    """
 
-    username = keyring.get_password('sn-sync-{}'.format(instance), 'username')
-    password = keyring.get_password('sn-sync-{}'.format(instance), 'password')
+    username, password = get_stored_auth_details(instance)
+    service = 'sn-sync-{}'.format(instance)
 
     if username is None:
         username = click.prompt('{} username'.format(instance))
 
         # Now try and set it in the keyring
-        keyring.set_password('sn-sync-{}'.format(instance), 'username', username)
+        keyring.set_password(service, 'username', username)
 
     if password is None:
         password = click.prompt('{} password'.format(instance), hide_input=True)
 
         # Now try and set it in the keyring
-        keyring.set_password('sn-sync-{}'.format(instance), 'password', password)
+        keyring.set_password(service, 'password', password)
 
+    _credentials[instance] = (username, password)
     return username, password
 
 
@@ -46,15 +92,19 @@ def clear_keyring(instance):
     """ Clear credentials stored in keyring for an instance
     :param instance: Instance to clear credentials for
     """
-    logger.debug("Clearing existing credentials for sn-sync-{}".format(instance))
-    keyring.delete_password('sn-sync-{}'.format(instance), 'username')
-    keyring.delete_password('sn-sync-{}'.format(instance), 'password')
+    service = 'sn-sync-{}'.format(instance)
+    logger.debug("Clearing existing credentials for %s", service)
+    _credentials.pop(instance, None)
+    keyring.delete_password(service, 'username')
+    keyring.delete_password(service, 'password')
 
 
-def setup_client(config, instance):
+def setup_client(config, instance, trust_stored=False):
     """ Sets up and tests a Service Now Client
     :param config: SNConfig object
     :param instance: Instance to setup client for
+    :param trust_stored: Skip testing the login when the credentials were already stored,
+        leaving the caller to handle a 401 from its first request
     """
 
     client = None
@@ -62,12 +112,17 @@ def setup_client(config, instance):
 
     # 3 attempts
     for x in range(3):
+        stored = None not in get_stored_auth_details(instance)
         username, password = prompt_for_auth_details(instance)
         client = SNClient(inst_config['host'],
                           username=username,
                           password=password,
                           verify=inst_config['verify_ssl'],
                           read_only=inst_config['read_only'])
+
+        if trust_stored and stored:
+            return client
+
         try:
             # Attempt a simple get to confirm that authentication is working
             client.get('invalid_table')
@@ -80,6 +135,32 @@ def setup_client(config, instance):
     raise LoginFailed("Unable to login to instance: {}".format(instance))
 
 
+def connect(config, instance, records, workers=DEFAULT_WORKERS):
+    """ Sets up a Service Now Client and fetches the meta for a list of records
+        Stored credentials are tested by the fetch itself rather than a separate request
+    :param config: SNConfig object
+    :param instance: Instance to setup client for
+    :param records: List of SNRecords to update meta for
+    :param workers: Maximum number of concurrent requests to Service Now
+    :returns: The SNClient
+    """
+    client = setup_client(config, instance, trust_stored=True)
+
+    try:
+        update_meta_bulk(client, records, instance, workers)
+    except HTTPError as err:
+        if err.response is None or err.response.status_code != 401:
+            raise
+        logger.error("Username/Password is incorrect")
+        clear_keyring(instance)
+
+        # Prompt for new credentials, testing them before fetching again
+        client = setup_client(config, instance)
+        update_meta_bulk(client, records, instance, workers)
+
+    return client
+
+
 def update_meta(client, record, instance):
     """ Fetch and update meta for a SNRecord on a particular instance
 
@@ -87,11 +168,90 @@ def update_meta(client, record, instance):
     :param record: SNRecord to update meta for
     :param instance: Name of the Service Now Instance
     """
-    logger.debug("Fetching meta for {}/{}".format(record.record_type, record.name))
+    logger.debug("Fetching meta for %s/%s", record.record_type, record.name)
     resp = client.get(record.table, query=record.get_sn_keys(), limit=1)
     record.update(instance, resp['records'][0])
 
 
+def update_meta_bulk(client, records, instance, workers=DEFAULT_WORKERS):
+    """ Fetch and update meta for a list of SNRecords, fetching the records of each
+        table in batches with a single request per batch
+
+        Records that can't be matched to a row of their batch, such as those keyed on
+        dot-walked, reference or choice fields whose display values differ from the key,
+        fall back to a query of their own
+
+    :param client: The SNClient to use
+    :param records: List of SNRecords to update meta for
+    :param instance: Name of the Service Now Instance
+    :param workers: Maximum number of requests to make at once
+    """
+
+    # Group the records by table and key fields, then by the values of their keys.
+    # Service Now string matching is case insensitive, so the values are casefolded
+    groups = {}
+    fallback = []
+    for record in records:
+        keys = record.get_sn_keys()
+        group = groups.setdefault((record.table, tuple(keys)), {})
+        values = tuple(value.casefold() for value in keys.values())
+        # Records whose keys only differ by case can't be told apart in a batch
+        if values in group:
+            fallback.append(record)
+        else:
+            group[values] = record
+
+    requests_list = []
+    batches = []
+    for (table, key_fields), group in groups.items():
+        # Each record is a separate query, ORed together with ^NQ. Batches are limited by
+        # both the number of records and the encoded length of the query
+        batch, clauses, length = {}, [], 0
+        for values, record in group.items():
+            clause = client.format_query(record.get_sn_keys())
+            clause_length = len(quote(clause, safe='')) + len(quote('^NQ', safe=''))
+            if batch and (len(batch) >= BULK_FETCH_SIZE
+                          or length + clause_length > BULK_QUERY_MAX_LENGTH):
+                requests_list.append(dict(table=table, query='^NQ'.join(clauses)))
+                batches.append((key_fields, batch))
+                batch, clauses, length = {}, [], 0
+            batch[values] = record
+            clauses.append(clause)
+            length += clause_length
+        if batch:
+            requests_list.append(dict(table=table, query='^NQ'.join(clauses)))
+            batches.append((key_fields, batch))
+
+    logger.debug("Fetching meta for %d records in %d requests", len(records), len(requests_list))
+
+    responses = client.get_many(requests_list, max_workers=workers)
+    for (key_fields, batch), resp in zip(batches, responses):
+        for row in resp['records']:
+            values = tuple(str(row.get(field, '')).casefold() for field in key_fields)
+            record = batch.pop(values, None)
+            if record is not None:
+                record.update(instance, row)
+        fallback.extend(batch.values())
+
+    if not fallback:
+        return
+
+    logger.debug("Fetching meta for %d unmatched records individually", len(fallback))
+
+    requests_list = [dict(table=record.table, query=record.get_sn_keys(), limit=1)
+                     for record in fallback]
+    missing = []
+    for record, resp in zip(fallback, client.get_many(requests_list, max_workers=workers)):
+        if resp['records']:
+            record.update(instance, resp['records'][0])
+        else:
+            missing.append(record)
+
+    if missing:
+        raise RecordNotFound("Unable to find records in instance {}: {}".format(
+            instance, ', '.join('{}/{}'.format(r.record_type, r.name) for r in missing)))
+
+
 def resolve_conflict(path, base, local, remote, confirm=True, prefer='local', notifications=False):
     """ Attempt to resolve a conflict between local and remote files
     :param base: A string containing the previous contents of the file
@@ -102,7 +262,6 @@ def resolve_conflict(path, base, local, remote, confirm=True, prefer='local', no
     :param notifications: Send notifications
     """
 
-    results = None
     action = 's'
 
     if confirm:
@@ -124,85 +283,105 @@ def resolve_conflict(path, base, local, remote, confirm=True, prefer='local', no
         )
 
         action = action[0]
+
     if action == 'o':
-        logger.debug("Overwriting with {} copy".format(prefer))
+        logger.debug("Overwriting with %s copy", prefer)
         if prefer == 'local':
-            results = local
+            return local
         elif prefer == 'remote':
-            results = remote
+            return remote
     elif action == 'm':
-        had_conflict, contents = merge3_has_conflict(
-            local.splitlines(True), base.splitlines(True), remote.splitlines(True))
-        contents = ''.join(contents)
+        # If only one side has changed there is nothing to merge
+        if local == base:
+            return remote
+        if remote == base:
+            return local
 
-        if had_conflict:
-            logger.debug("File has a conflict")
-            contents = click.edit(text=contents, require_save=True)
+        had_conflict, lines = merge3_has_conflict(
+            local.splitlines(True), base.splitlines(True), remote.splitlines(True))
 
-        return contents
+        if not had_conflict:
+            return ''.join(lines)
 
-    elif not confirm or action == 's':
-        return None
+        # Returns None if the editor was closed without saving, skipping the file
+        logger.debug("File has a conflict")
+        return click.edit(text=''.join(lines), require_save=True)
 
-    return results
+    # Skipped
+    return None
 
 
-def do_pull(config, cache, instance, files=None, confirm=True):
+def do_pull(config, cache, instance, files=None, confirm=True, workers=DEFAULT_WORKERS):
     """ Pull down update from Service Now, updating local files
     :param config: SNConfig object
     :param cache: SNCache Object
     :param instance: Instance to pull from
     :param files: List of local files to pull
     :param confirm: Require confirmation before overwriting local files
+    :param workers: Maximum number of concurrent requests to Service Now
     """
-    client = setup_client(config, instance)
-    for record in cache.get_records(files=files):
-        update_meta(client, record, instance)
-        # Compare any files that match the files passed in
-        for name, field, file, status in record.compare(instance, files=files):
-            # If the file has not been modified, we can continue
-            if status == ModStatus.NOCHANGE:
-                logger.debug("File not modified - not saving")
-                continue
-            # For files that have been modified, we need to either merge or overwrite the file
-            if status == ModStatus.LOCAL or status == ModStatus.BOTH:
-                contents = resolve_conflict(
-                    str(file.relative_path),
-                    field['prev_contents'],
-                    file.contents,
-                    field['contents'],
-                    prefer='remote')
-                # If this file was skipped or something went wrong
-                if contents is None:
-                    logger.warn("Skipping file: {}".format(file))
+    records = cache.get_records(files=files)
+    client = connect(config, instance, records, workers)
+    cache.prefetch_hashes(instance, records)
+    try:
+        for record in records:
+            # Compare any files that match the files passed in
+            for name, field, file, status in record.compare(instance, files=files):
+                # If the file has not been modified, we can continue
+                if status == ModStatus.NOCHANGE:
+                    logger.debug("File not modified - not saving")
                     continue
-            # Else we can just overwrite the local content
-            elif status == ModStatus.REMOTE:
-                logger.debug("File modified remotely - updating")
-                contents = field['contents']
+                # Without confirmation local only changes are kept, and the remote copy is
+                # taken when both sides have changed, so there is nothing to resolve
+                if not confirm and status == ModStatus.LOCAL:
+                    logger.warning("Skipping locally modified file: %s", file)
+                    continue
+                elif not confirm and status == ModStatus.BOTH:
+                    logger.debug("Overwriting with remote copy")
+                    contents = field['contents']
+                # For files that have been modified, we need to either merge or overwrite the file
+                elif status == ModStatus.LOCAL or status == ModStatus.BOTH:
+                    contents = resolve_conflict(
+                        str(file.relative_path),
+                        field['prev_contents'],
+                        file.contents,
+                        field['contents'],
+                        prefer='remote')
+                    # If this file was skipped or something went wrong
+                    if contents is None:
+                        logger.warning("Skipping file: %s", file)
+                        continue
+                # Else we can just overwrite the local content
+                elif status == ModStatus.REMOTE:
+                    logger.debug("File modified remotely - updating")
+                    contents = field['contents']
 
-            # Now save the file
-            file.save(contents)
-            record.update_field_meta(instance, name)
+                # Now save the file
+                file.save(contents)
+                record.update_field_meta(instance, name)
 
-        record.save()
+            # Saved together once every record has been processed
+            record.mark_dirty()
+    finally:
+        cache.flush()
 
 
-def get_status(config, cache, instance):
+def get_status(config, cache, instance, workers=DEFAULT_WORKERS):
     """ Print differences between local files and remote files
     :param config: SNConfig object
     :param cache: SNCache Object
     :param instance: Instance to compare
+    :param workers: Maximum number of concurrent requests to Service Now
     """
 
-    client = setup_client(config, instance)
-
     local = []
     remote = []
     both = []
 
-    for record in cache.get_records():
-        update_meta(client, record, instance)
+    records = cache.get_records()
+    connect(config, instance, records, workers)
+    cache.prefetch_hashes(instance, records)
+    for record in records:
         # Compare any files that match the files passed in
         for name, field, file, status in record.compare(instance):
             if status == ModStatus.NOCHANGE:
@@ -244,111 +423,213 @@ def get_status(config, cache, instance):
         click.echo("No files modified")
 
 
-def do_diff(config, cache, instance, files=None):
+def do_diff(config, cache, instance, files=None, workers=DEFAULT_WORKERS):
     """ Show diffs between local and remote files
     :param config: SNConfig object
     :param cache: SNCache Object
     :param instance: Instance to compare
     :param files: List of local files to compare
+    :param workers: Maximum number of concurrent requests to Service Now
     """
-    client = setup_client(config, instance)
+    records = cache.get_records(files=files)
+    connect(config, instance, records, workers)
+
+    diffs = iter_diffs(records, instance, files=files)
+    first = next(diffs, None)
+
+    # Display the results, the pager is fed the diffs as they are generated
+    if first is not None:
+        click.echo_via_pager(chain((first,), diffs))
+    else:
+        click.echo("No files modified")
 
-    diffs = []
 
-    for record in cache.get_records(files=files):
-        update_meta(client, record, instance)
+def iter_diffs(records, instance, files=None):
+    """ Generate the lines of the diffs between local and remote files
+    :param records: List of SNRecords to compare
+    :param instance: Instance to compare
+    :param files: List of local files to compare
+    """
+    for record in records:
         for name, file in record.get_files(files=files):
             field = record.meta[instance]['fields'][name]
+            # Skip reading and diffing files that match the remote
+            if record.get_local_hash(instance, name, file) == field['hash']:
+                continue
             diff = difflib.unified_diff(
                 field['contents'].splitlines(True),
-                file.contents.splitlines(True),
+                file.lines,
                 fromfile='remote',
                 tofile='local'
             )
-            diff = ''.join(diff)
-            if diff:
-                diffs.append('{}:\n{}\n'.format(file.relative_path, diff))
-
-    # Display the results
-    if diffs:
-        click.echo_via_pager(''.join(diffs))
-    else:
-        click.echo("No files modified")
+            first = next(diff, None)
+            if first is not None:
+                yield '{}:\n'.format(file.relative_path)
+                yield first
+                yield from diff
+                yield '\n'
 
 
-def do_push(config, cache, instance, files=None):
+def do_push(config, cache, instance, files=None, confirm=True, workers=DEFAULT_WORKERS):
     """ Pushes changes made to local files up to the service now instance
 
     :param config: SNConfig instance
     :param cache: SNCache instance
     :param instance: Name of the Service Now Instance
     :param files: List of files to push to Service Now
+    :param confirm: Require confirmation before overwriting remote files
+    :param workers: Maximum number of concurrent requests to Service Now
     :returns: 0 on success, 1 on failure
     """
-    client = setup_client(config, instance)
-
-    for record in cache.get_records(files=files):
-        update_meta(client, record, instance)
-        for name, field, file, status in record.compare(instance, files=files):
-            # If the file has not been modified, we can continue
-            if status == ModStatus.NOCHANGE:
-                logger.debug("File not modified - not saving")
-                continue
-            # For files that have been modified, we need to either merge or overwrite the file
-            if status == ModStatus.REMOTE or status == ModStatus.BOTH:
-                contents = resolve_conflict(
-                    str(file.relative_path),
-                    field['prev_contents'],
-                    file.contents,
-                    field['contents'],
-                    prefer='local')
-                # If this file was skipped or something went wrong
-                if contents is None:
-                    logger.warn("Skipping file: {}".format(file))
+    records = cache.get_records(files=files)
+    client = connect(config, instance, records, workers)
+    cache.prefetch_hashes(instance, records)
+    try:
+        for record in records:
+            for name, field, file, status in record.compare(instance, files=files):
+                # If the file has not been modified, we can continue
+                if status == ModStatus.NOCHANGE:
+                    logger.debug("File not modified - not saving")
                     continue
-            # Else we can just overwrite the remote content
-            elif status == ModStatus.LOCAL:
-                logger.debug("File modified locally - updating")
-                contents = file.contents
+                # Without confirmation remote only changes are kept, and the local copy is
+                # taken when both sides have changed, so there is nothing to resolve
+                if not confirm and status == ModStatus.REMOTE:
+                    logger.warning("Skipping remotely modified file: %s", file)
+                    continue
+                elif not confirm and status == ModStatus.BOTH:
+                    logger.debug("Overwriting with local copy")
+                    contents = file.contents
+                # For files that have been modified, we need to either merge or overwrite the file
+                elif status == ModStatus.REMOTE or status == ModStatus.BOTH:
+                    contents = resolve_conflict(
+                        str(file.relative_path),
+                        field['prev_contents'],
+                        file.contents,
+                        field['contents'],
+                        prefer='local')
+                    # If this file was skipped or something went wrong
+                    if contents is None:
+                        logger.warning("Skipping file: %s", file)
+                        continue
+                # Else we can just overwrite the remote content
+                elif status == ModStatus.LOCAL:
+                    logger.debug("File modified locally - updating")
+                    contents = file.contents
 
-            # Now save the file
-            file.save(contents)
-            resp = client.update(record.table, record.get_sys_id(instance), {
-                name: contents
-            })
-            update_meta(client, record, instance)
-            record.update_field_meta(instance, name)
+                # Now save the file
+                file.save(contents)
+                row = client.update(record.table, record.get_sys_id(instance), {
+                    name: contents
+                })
+                # The response holds the updated record, only fetch it again if it is missing
+                if row is not None:
+                    record.update(instance, row)
+                else:
+                    update_meta(client, record, instance)
+                record.update_field_meta(instance, name)
 
-        record.save()
+            # Saved together once every record has been processed
+            record.mark_dirty()
+    finally:
+        cache.flush()
 
 
-class SNSyncHandler(FileSystemEventHandler):
+class SNSyncHandler(PatternMatchingEventHandler):
     """ Watches the filesystem for changes to be sent up to service now """
 
     def __init__(self, config, cache, instance, client):
+        # Only handle files with an extension used by a record field, ignoring
+        # editor swap files, backups and other temporary files
+        super().__init__(
+            patterns=sorted({'*' + ext for record in config.records.values()
+                             for ext in record['fields'].values()}),
+            ignore_directories=True)
+
         self._config = config
         self._cache = cache
         self._instance = instance
         self._client = client
 
-        self._ignored = []
+        # Stat keys of the files this handler has written, keyed by resolved path, so the
+        # events from those writes are not synced back to Service Now
+        self._written = {}
+
+        # Modified paths are queued and synced by a single worker thread, so the
+        # observer thread is never blocked on Service Now
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._process_queue, daemon=True)
+
+    def start(self):
+        """ Start the worker thread """
+        self._worker.start()
 
-    def dispatch(self, event):
-        if event.is_directory:
-            return
-        super().dispatch(event)
+    def stop(self):
+        """ Stop the worker thread, once it has synced the files still pending """
+        self._queue.put(None)
+        self._worker.join()
 
     def on_modified(self, event):
         """ Triggered when a file is modified """
+        self._queue.put((event.src_path, time.monotonic()))
 
-        # If we have just processed this file, ignore it once
-        if (event.src_path in self._ignored):
-            self._ignored.remove(event.src_path)
-            return
+    def _process_queue(self):
+        """ Sync queued paths once they have not been modified for WATCH_DEBOUNCE seconds """
 
-        for record in self._cache.get_records(files=[event.src_path]):
+        # Paths waiting to be synced, with the time they were last modified
+        pending = {}
+
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0, min(pending.values()) + WATCH_DEBOUNCE - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                if item is None:
+                    # Stopping, sync whatever is still pending first
+                    for path in pending:
+                        self._sync_file_safe(path)
+                    return
+                # Debounced on when the event happened, not when it was taken off the queue
+                path, modified = item
+                pending[path] = modified
+
+            now = time.monotonic()
+            for path in [p for p, modified in pending.items() if now - modified >= WATCH_DEBOUNCE]:
+                del pending[path]
+                self._sync_file_safe(path)
+
+    def _sync_file_safe(self, path):
+        """ Sync a modified file, logging rather than raising any error
+        :param path: path to the modified file
+        """
+        try:
+            self.sync_file(path)
+        except Exception as err:
+            logger.error("Unable to sync file %s: %s", path, err)
+
+    def sync_file(self, path):
+        """ Sync a modified file with Service Now
+        :param path: path to the modified file
+        """
+
+        # Ignore the event from our own write, unless the file has been changed since
+        written = self._written.pop(os.path.realpath(path), None)
+        if written is not None:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return
+            if (st.st_mtime_ns, st.st_size) == written:
+                logger.debug("Ignoring our own write to %s", path)
+                return
+
+        for record in self._cache.get_records(files=[path]):
             update_meta(self._client, record, self._instance)
-            for name, field, file, status in record.compare(self._instance, files=[event.src_path]):
+            for name, field, file, status in record.compare(self._instance, files=[path]):
                 if status == ModStatus.NOCHANGE:
                     logger.debug("File not modified - not saving")
                     continue
@@ -362,35 +643,39 @@ class SNSyncHandler(FileSystemEventHandler):
                         prefer='local', notifications=True)
                     # If this file was skipped or something went wrong
                     if contents is None:
-                        logger.warn("Skipping file: {}".format(file))
+                        logger.warning("Skipping file: %s", file)
                         continue
                 # Else we can just overwrite the remote content
                 elif status == ModStatus.LOCAL:
                     logger.debug("File modified locally - updating")
                     contents = file.contents
 
-                # Now save the file
-                file.save(contents)
+                # Now save the file, if it has changed
+                if contents != file.contents:
+                    file.save(contents)
+                    self._written[file.resolved_path] = file.stat_key
 
-                # Temporarily add this file to the ignore list
-                self._ignored.append(event.src_path)
-
-                resp = self._client.update(record.table, record.get_sys_id(self._instance), {
+                row = self._client.update(record.table, record.get_sys_id(self._instance), {
                     name: contents
                 })
-                update_meta(self._client, record, self._instance)
+                if row is not None:
+                    record.update(self._instance, row)
+                else:
+                    update_meta(self._client, record, self._instance)
                 record.update_field_meta(self._instance, name)
 
             record.save()
 
 
-def do_watch(config, cache, instance):
-    """ Watch the local folders """
-    client = setup_client(config, instance)
-
+def do_watch(config, cache, instance, workers=DEFAULT_WORKERS):
+    """ Watch the local folders
+    :param config: SNConfig object
+    :param cache: SNCache Object
+    :param instance: Instance to sync with
+    :param workers: Maximum number of concurrent requests to Service Now
+    """
     # Update all records
-    for record in cache.get_records():
-        update_meta(client, record, instance)
+    client = connect(config, instance, cache.get_records(), workers)
 
     event_handler = SNSyncHandler(config, cache, instance, client)
     observer = Observer()
@@ -401,13 +686,14 @@ def do_watch(config, cache, instance):
         path = Path('.', record_type)
         if path.is_dir():
             watching = True
-            logger.debug("Watching {}".format(path))
+            logger.debug("Watching %s", path)
             observer.schedule(event_handler, path=str(path), recursive=True)
 
     if not watching:
         logger.error("No directories found to watch")
         return 1
 
+    event_handler.start()
     observer.start()
 
     try:
@@ -416,3 +702,4 @@ def do_watch(config, cache, instance):
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    event_handler.stop()